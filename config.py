@@ -54,10 +54,74 @@ class ToolConfig:
     ALLOWED_FILE_EXTENSIONS = [".txt", ".json", ".py", ".md", ".log"]
     RESTRICTED_PATHS = ["/etc", "/var", "/usr", "/bin", "/sbin"]
     
+    # 文件写入 fsync 策略: "never" 从不, "commit" 仅在原子提交时（分段上传提交、Base64 写入目标文件）, "always" 每次写入后
+    FILE_FSYNC_POLICY = "commit"
+    
+    # 分段上传的分段文件超过该时间未更新视为已放弃，开始新上传时清理
+    UPLOAD_PART_TTL = 24 * 3600  # 秒
+    
+    # Base64 流式处理配置（块大小需为 3 和 4 的公倍数）
+    BASE64_CHUNK_SIZE = 192 * 1024  # 192KB
+    
     # 网络检查配置
     DEFAULT_NETWORK_TEST_URL = "https://www.google.com"
     NETWORK_TIMEOUT = 10
 
+def clamp_rate(rate: float, default: float = 0.0) -> float:
+    """将比例限制在 0.0 - 1.0，NaN 时使用默认值"""
+    if rate != rate:  # NaN
+        return default
+    return min(max(rate, 0.0), 1.0)
+
+def _env_rate(name: str, default: float = 0.0) -> float:
+    """读取 0.0 - 1.0 之间的比例环境变量，无法解析时使用默认值"""
+    try:
+        return clamp_rate(float(os.getenv(name, default)), default)
+    except ValueError:
+        return default
+
+# ==================== 追踪配置 ====================
+
+class TracingConfig:
+    """追踪与性能分析配置（可通过环境变量覆盖，运行时可用 configureTracing 工具调整）"""
+    
+    # 是否记录每次工具调用的阶段耗时
+    ENABLED = os.getenv("MCP_TRACE", "0") == "1"
+    
+    # 追踪文件（Chrome Trace Event 格式，可用 chrome://tracing 或 Perfetto 打开）
+    TRACE_FILE = os.getenv("MCP_TRACE_FILE", "traces/trace.json")
+    
+    # cProfile 结果输出目录
+    PROFILE_DIR = os.getenv("MCP_PROFILE_DIR", "traces/profiles")
+    
+    # 按比例采样分析的调用比例 (0.0 - 1.0)
+    PROFILE_RATE = _env_rate("MCP_PROFILE_RATE")
+    
+    # 对指定工具的每次调用进行分析
+    PROFILE_TOOL = os.getenv("MCP_PROFILE_TOOL") or None
+    
+    # 追踪事件和分析结果由后台线程定期写入的间隔
+    FLUSH_INTERVAL = 1.0  # 秒
+
+# ==================== 流量录制配置 ====================
+
+class RecordConfig:
+    """流量录制配置（用于 replay.py 回放和容量测试）"""
+    
+    # 是否录制每次工具调用
+    ENABLED = os.getenv("MCP_RECORD", "0") == "1"
+    
+    # 录制文件（JSONL，每行一次调用）
+    RECORD_FILE = os.getenv("MCP_RECORD_FILE", "records/traffic.jsonl")
+    
+    # 缓冲写入配置
+    FLUSH_INTERVAL = 1.0  # 秒
+    MAX_BUFFER = 1000  # 条，缓冲达到该数量时立即写入
+    MAX_PENDING = 10000  # 条，写入失败积压时最多保留的记录数，超出后丢弃最早的记录
+    
+    # 超过该长度的字符串参数只记录长度，回放时用等长内容替代
+    MAX_ARG_CHARS = 1024
+
 # ==================== 环境配置 ====================
 
 class EnvironmentConfig:
@@ -150,6 +214,11 @@ TOOLS_CONFIG = {
         "category": "system",
         "enabled": True
     },
+    "configureTracing": {
+        "description": "运行时调整追踪与采样分析",
+        "category": "system",
+        "enabled": True
+    },
     "checkNetwork": {
         "description": "检查网络连接",
         "category": "network",
@@ -184,6 +253,8 @@ def get_config(env: str = None) -> Dict[str, Any]:
     config = {
         "server": ServerConfig,
         "tools": ToolConfig,
+        "tracing": TracingConfig,
+        "record": RecordConfig,
         "environment": EnvironmentConfig,
         "tools_config": TOOLS_CONFIG,
         "categories": TOOL_CATEGORIES
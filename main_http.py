@@ -6,8 +6,10 @@ MCP HTTP 服务器主文件
 
 import asyncio
 from fastmcp import FastMCP
-from config import ServerConfig, get_config
+from config import ServerConfig, RecordConfig, get_config
 from tools import register_tools
+from tracing import tracer, TracingMiddleware
+from recorder import TrafficRecorder
 
 async def main():
     """主函数"""
@@ -24,20 +26,37 @@ async def main():
     # 注册所有工具
     register_tools(mcp)
     
+    # 追踪中间件（未开启时直接透传）
+    mcp.add_middleware(TracingMiddleware(tracer))
+    
+    # 流量录制（可选，用于 replay.py 回放）
+    recorder = None
+    if RecordConfig.ENABLED:
+        recorder = TrafficRecorder.from_config()
+        mcp.add_middleware(recorder)
+    
     print("🚀 启动 MCP HTTP 服务器...")
     print(f"📋 服务器名称: {ServerConfig.NAME}")
     print(f"📋 版本: {ServerConfig.VERSION}")
     print(f"📋 描述: {ServerConfig.DESCRIPTION}")
     print(f"🌐 服务地址: http://{ServerConfig.HOST}:{ServerConfig.PORT}/mcp/")
     print(f"🔧 可用工具数量: {len(get_config()['tools_config'])}")
+    if tracer.enabled:
+        print(f"🔍 调用追踪已开启: {tracer.trace_file}")
+    if recorder:
+        print(f"📼 流量录制已开启: {recorder.record_file}")
     
     # 启动 HTTP 服务器
-    await mcp.run_http_async(
-        host=ServerConfig.HOST,
-        port=ServerConfig.PORT,
-        show_banner=True,
-        log_level=ServerConfig.LOG_LEVEL
-    )
+    try:
+        await mcp.run_http_async(
+            host=ServerConfig.HOST,
+            port=ServerConfig.PORT,
+            show_banner=True,
+            log_level=ServerConfig.LOG_LEVEL
+        )
+    finally:
+        if recorder:
+            await recorder.close()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+MCP 流量录制模块
+将每次工具调用（工具名、参数、耗时、结果大小）缓冲后异步追加到 JSONL 文件，
+录制结果可用 replay.py 回放
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Dict, List
+from fastmcp.server.middleware import Middleware
+from config import RecordConfig
+
+logger = logging.getLogger(__name__)
+
+# 大字符串参数的占位键，replay.py 据此生成等长内容
+SIZE_MARKER = "$size"
+
+def _result_size(result: Any) -> int:
+    """估算工具结果大小（字符数）"""
+    content = getattr(result, "content", result)
+    if isinstance(content, list):
+        return sum(len(getattr(item, "text", "") or "") for item in content)
+    return len(str(content))
+
+def summarize_arguments(value: Any, max_chars: int) -> Any:
+    """将超长字符串替换为 {"$size": 长度}，避免录制完整的文件内容等大负载"""
+    if isinstance(value, str) and len(value) > max_chars:
+        return {SIZE_MARKER: len(value)}
+    if isinstance(value, dict):
+        return {k: summarize_arguments(v, max_chars) for k, v in value.items()}
+    if isinstance(value, list):
+        return [summarize_arguments(v, max_chars) for v in value]
+    return value
+
+class TrafficRecorder(Middleware):
+    """录制工具调用的 FastMCP 中间件"""
+
+    def __init__(self, record_file: str, flush_interval: float = 1.0, max_buffer: int = 1000,
+                 max_pending: int = 10000, max_arg_chars: int = 1024):
+        self.record_file = record_file
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_arg_chars = max_arg_chars
+        self.dropped = 0
+        self._buffer: deque = deque(maxlen=max(max_pending, max_buffer))
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+
+    @classmethod
+    def from_config(cls) -> "TrafficRecorder":
+        """根据 RecordConfig 创建录制器"""
+        return cls(
+            record_file=RecordConfig.RECORD_FILE,
+            flush_interval=RecordConfig.FLUSH_INTERVAL,
+            max_buffer=RecordConfig.MAX_BUFFER,
+            max_pending=RecordConfig.MAX_PENDING,
+            max_arg_chars=RecordConfig.MAX_ARG_CHARS
+        )
+
+    async def on_call_tool(self, context, call_next):
+        timestamp = time.time()
+        start = time.perf_counter()
+        result = None
+        error = None
+        try:
+            result = await call_next(context)
+            return result
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._record({
+                "ts": timestamp,
+                "tool": context.message.name,
+                "arguments": summarize_arguments(context.message.arguments or {}, self.max_arg_chars),
+                "duration_ms": (time.perf_counter() - start) * 1000,
+                "result_size": _result_size(result) if result is not None else 0,
+                "error": error
+            })
+
+    def _record(self, entry: Dict[str, Any]):
+        """加入缓冲区（参数已精简，积压时不会保留完整的大负载），由后台任务批量写入；积压超出上限时丢弃最早的记录"""
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(entry)
+        if self._task is None and not self._closing:
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+        if len(self._buffer) >= self.max_buffer:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        """定期或缓冲区满时写入文件，写入失败时记录日志并在下一轮重试"""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("流量录制写入失败: %s (已丢弃 %d 条)", e, self.dropped)
+
+    async def flush(self):
+        """将缓冲区写入文件（JSON 序列化和写入在线程中执行，不阻塞事件循环）
+
+        写入失败时记录放回缓冲区，等待下次重试
+        """
+        if not self._buffer:
+            return
+        batch = list(self._buffer)
+        self._buffer.clear()
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except BaseException:
+            # 放回未写入的记录，超出上限的最早记录会被丢弃
+            pending = list(self._buffer)
+            self._buffer.clear()
+            for entry in batch + pending:
+                if len(self._buffer) == self._buffer.maxlen:
+                    self.dropped += 1
+                self._buffer.append(entry)
+            raise
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        lines = "".join(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in batch)
+        directory = os.path.dirname(self.record_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.record_file, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+    async def close(self):
+        """停止后台任务并尽量写入剩余记录，失败时只记录日志"""
+        self._closing = True
+        self._wakeup.set()
+        try:
+            if self._task is not None:
+                await self._task
+                self._task = None
+            await self.flush()
+        except Exception as e:
+            logger.warning("流量录制关闭时写入失败，%d 条记录未保存: %s", len(self._buffer), e)
+        if self.dropped:
+            logger.warning("流量录制共丢弃 %d 条记录", self.dropped)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+MCP 流量回放工具
+按原始或加速后的节奏重放 recorder.py 录制的调用，输出延迟与吞吐量报告
+"""
+
+import json
+import math
+import time
+import heapq
+import asyncio
+import argparse
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from unittest import mock
+from fastmcp import Client, FastMCP
+from config import ServerConfig, RecordConfig
+from tools import register_tools
+from recorder import SIZE_MARKER
+
+# 会修改服务器状态（文件、追踪设置）的工具，默认不回放
+WRITE_TOOLS = {"fileWrite", "configureTracing"}
+
+# 录制文件按调用完成顺序写入，与开始时间 ts 只有局部乱序，在该窗口内重新排序
+REORDER_WINDOW = 1000
+
+class _StubResponse:
+    """替代外部服务响应的桩对象"""
+    status_code = 200
+    text = ""
+
+    def json(self) -> Dict[str, Any]:
+        return {}
+
+def _stub_get(latency_ms: float):
+    """生成替代 requests.get 的函数，模拟固定的上游延迟
+
+    进程内模式下客户端与服务器共用一个事件循环，time.sleep 会阻塞整个回放，
+    吞吐量上限约为 1000 / latency_ms 次/秒，与 --concurrency 无关
+    """
+    def get(*args, **kwargs):
+        if latency_ms > 0:
+            time.sleep(latency_ms / 1000)
+        return _StubResponse()
+    return get
+
+def _has_side_effects(record: Dict[str, Any]) -> bool:
+    """判断录制的调用是否会修改服务器状态"""
+    if record.get("tool") in WRITE_TOOLS:
+        return True
+    if record.get("tool") == "base64Encode":
+        params = (record.get("arguments") or {}).get("params") or {}
+        return params.get("dest_path") is not None
+    return False
+
+def filter_records(records: Iterable[Dict[str, Any]], exclude: Iterable[str] = (),
+                   include_writes: bool = False,
+                   stats: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+    """去掉排除的工具，未指定 include_writes 时同时去掉有副作用的调用；stats 中累计跳过的条数"""
+    exclude = set(exclude)
+    for record in records:
+        if record.get("tool") in exclude:
+            if stats is not None:
+                stats["excluded"] = stats.get("excluded", 0) + 1
+        elif not include_writes and _has_side_effects(record):
+            if stats is not None:
+                stats["writes"] = stats.get("writes", 0) + 1
+        else:
+            yield record
+
+def expand_arguments(value: Any) -> Any:
+    """将录制时省略的大字符串 {"$size": n} 还原为等长内容"""
+    if isinstance(value, dict):
+        if set(value) == {SIZE_MARKER}:
+            return "x" * value[SIZE_MARKER]
+        return {k: expand_arguments(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [expand_arguments(v) for v in value]
+    return value
+
+def iter_records(path: str, tool: Optional[str] = None,
+                 window: int = REORDER_WINDOW) -> Iterator[Dict[str, Any]]:
+    """逐行读取录制文件，在有限窗口内按 ts 重新排序后输出，不把整个文件读入内存"""
+    heap = []
+    counter = itertools.count()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if tool is not None and record.get("tool") != tool:
+                continue
+            heapq.heappush(heap, (record["ts"], next(counter), record))
+            if len(heap) > window:
+                yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+def percentile(values: List[float], p: float) -> float:
+    """最近秩百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def _latency_summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0
+    }
+
+async def replay(client: Client, records: Iterable[Dict[str, Any]], speed: float = 1.0,
+                 concurrency: int = 100) -> Dict[str, Any]:
+    """按录制节奏（除以 speed）重放调用，speed <= 0 表示不等待、尽快发送
+
+    单个调度循环按计划时间依次发出调用，同时在途的调用数不超过 concurrency。
+    延迟从计划发送时间开始计算，包含等待并发名额和落后于计划的时间，
+    避免系统饱和时低估延迟；实际发送后的耗时和落后时间另行统计
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[Dict[str, Any]] = []
+    in_flight = set()
+    first_ts = None
+    start = time.perf_counter()
+
+    async def run(record: Dict[str, Any], scheduled: float, call_start: float):
+        error = None
+        try:
+            await client.call_tool(record["tool"], expand_arguments(record.get("arguments") or {}))
+        except Exception as e:
+            error = str(e)
+        finally:
+            semaphore.release()
+        end = time.perf_counter()
+        results.append({
+            "tool": record["tool"],
+            "latency_ms": (end - scheduled) * 1000,
+            "service_ms": (end - call_start) * 1000,
+            "lag_ms": (call_start - scheduled) * 1000,
+            "recorded_ms": record.get("duration_ms"),
+            "error": error
+        })
+
+    for record in records:
+        if first_ts is None:
+            first_ts = record["ts"]
+            start = time.perf_counter()
+        if speed > 0:
+            scheduled = start + (record["ts"] - first_ts) / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            scheduled = time.perf_counter()
+        await semaphore.acquire()
+        task = asyncio.create_task(run(record, scheduled, time.perf_counter()))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    return build_report(results, time.perf_counter() - start)
+
+def build_report(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """汇总延迟与吞吐量，并与录制时的耗时对比"""
+    by_tool: Dict[str, List[Dict[str, Any]]] = {}
+    for result in results:
+        by_tool.setdefault(result["tool"], []).append(result)
+
+    tools = {}
+    for name, items in sorted(by_tool.items()):
+        recorded = [i["recorded_ms"] for i in items if i["recorded_ms"] is not None]
+        tools[name] = {
+            "calls": len(items),
+            "errors": sum(1 for i in items if i["error"]),
+            "latency_ms": _latency_summary([i["latency_ms"] for i in items]),
+            "service_ms": _latency_summary([i["service_ms"] for i in items]),
+            "recorded_p50_ms": percentile(recorded, 50) if recorded else None
+        }
+
+    return {
+        "calls": len(results),
+        "errors": sum(1 for r in results if r["error"]),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": _latency_summary([r["latency_ms"] for r in results]),
+        "service_ms": _latency_summary([r["service_ms"] for r in results]),
+        "lag_ms": _latency_summary([r["lag_ms"] for r in results]),
+        "tools": tools
+    }
+
+def print_report(report: Dict[str, Any]):
+    """打印回放报告"""
+    def fmt(stats: Dict[str, float]) -> str:
+        return (f"p50={stats['p50']:.1f}ms p90={stats['p90']:.1f}ms "
+                f"p99={stats['p99']:.1f}ms max={stats['max']:.1f}ms")
+
+    print("📊 回放报告:")
+    print(f"  调用次数: {report['calls']} (错误 {report['errors']})")
+    print(f"  耗时: {report['elapsed_s']:.2f} s")
+    print(f"  吞吐量: {report['throughput_rps']:.1f} 次/秒")
+    print(f"  延迟（自计划发送时间）: {fmt(report['latency_ms'])}")
+    print(f"  服务耗时（自实际发送）: {fmt(report['service_ms'])}")
+    print(f"  落后计划: {fmt(report['lag_ms'])}")
+    print("\n  按工具:")
+    for name, stats in report["tools"].items():
+        tool_latency = stats["latency_ms"]
+        service = stats["service_ms"]
+        recorded = stats["recorded_p50_ms"]
+        recorded_text = f"{recorded:.1f}ms" if recorded is not None else "N/A"
+        print(f"  🔹 {name}: {stats['calls']} 次, 错误 {stats['errors']}, "
+              f"p50={tool_latency['p50']:.1f}ms p99={tool_latency['p99']:.1f}ms, "
+              f"服务 p50={service['p50']:.1f}ms, 录制 p50={recorded_text}")
+
+async def run_replay(args) -> Dict[str, Any]:
+    """连接目标服务器（或进程内服务器）并回放"""
+    skipped: Dict[str, int] = {}
+    records = filter_records(iter_records(args.file, args.tool), args.exclude, args.include_writes, skipped)
+    if args.limit:
+        records = itertools.islice(records, args.limit)
+    print(f"📼 回放录制文件: {args.file}")
+
+    if args.url:
+        target = args.url
+    else:
+        # 进程内服务器，便于替换外部服务
+        target = FastMCP(name=ServerConfig.NAME, version=ServerConfig.VERSION)
+        register_tools(target)
+
+    stub = None
+    if args.stub_upstream:
+        if args.url:
+            print("⚠️  --stub-upstream 仅在进程内模式（不指定 --url）下生效")
+        else:
+            if args.stub_latency_ms > 0:
+                print(f"⚠️  进程内模式下桩延迟会阻塞整个事件循环，吞吐量上限约 "
+                      f"{1000 / args.stub_latency_ms:.0f} 次/秒")
+            stub = mock.patch("requests.get", _stub_get(args.stub_latency_ms))
+            stub.start()
+
+    try:
+        async with Client(target) as client:
+            report = await replay(client, records, speed=args.speed, concurrency=args.concurrency)
+    finally:
+        if stub:
+            stub.stop()
+
+    if skipped.get("excluded"):
+        print(f"💡 已跳过 {skipped['excluded']} 条被排除工具的调用")
+    if skipped.get("writes"):
+        print(f"💡 已跳过 {skipped['writes']} 条有副作用的调用（{', '.join(sorted(WRITE_TOOLS))}、"
+              "带 dest_path 的 base64Encode），使用 --include-writes 回放")
+    return report
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="回放录制的 MCP 流量并输出延迟与吞吐量报告")
+    parser.add_argument("file", nargs="?", default=RecordConfig.RECORD_FILE, help="录制文件路径")
+    parser.add_argument("--url", help="目标服务器地址，例如 http://localhost:8000/mcp/；不指定时使用进程内服务器")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速，2 表示两倍速，0 表示尽快发送")
+    parser.add_argument("--concurrency", type=int, default=100, help="最大并发调用数")
+    parser.add_argument("--tool", help="只回放指定工具")
+    parser.add_argument("--exclude", action="append", default=[], help="不回放指定工具，可重复使用")
+    parser.add_argument("--include-writes", action="store_true",
+                        help="同时回放有副作用的调用（fileWrite、configureTracing、带 dest_path 的 base64Encode）")
+    parser.add_argument("--limit", type=int, help="最多回放的记录数")
+    parser.add_argument("--stub-upstream", action="store_true", help="用桩替换外部服务请求")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0,
+                        help="桩响应的模拟延迟（毫秒）；进程内模式下会阻塞整个事件循环")
+    parser.add_argument("--report", help="将报告以 JSON 格式写入文件")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_replay(args))
+    print_report(report)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 报告已写入: {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+fileWrite 工具测试（追加、偏移写入、分段上传协议）
+运行: python -m pytest test_file_write.py
+"""
+
+import os
+import time
+from config import ToolConfig
+from tools import FileWriteParams, FileListParams, file_write, file_list
+
+def write(path, content="", **kwargs):
+    return file_write(FileWriteParams(path=str(path), content=content, **kwargs))
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def part_files(directory):
+    return [item for item in os.listdir(directory) if item.endswith(".part")]
+
+def test_overwrite_writes_through_symlink(tmp_path):
+    target = tmp_path / "target.txt"
+    target.write_text("old")
+    link = tmp_path / "link.txt"
+    os.symlink(target, link)
+    assert write(link, "new").startswith("✅")
+    assert os.path.islink(link)
+    assert target.read_text() == "new"
+
+def test_overwrite_bare_filename(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert write("bare.txt", "hello").startswith("✅")
+    assert read("bare.txt") == b"hello"
+
+def test_overwrite_default_encoding(tmp_path):
+    path = tmp_path / "a.txt"
+    assert write(path, "abc", encoding=None).startswith("✅")
+    assert read(path) == b"abc"
+
+def test_append_and_offset(tmp_path):
+    path = tmp_path / "a.txt"
+    write(path, "hello")
+    write(path, " world", mode="append")
+    write(path, "HE", offset=0)
+    assert read(path) == b"HEllo world"
+
+def test_append_rejects_repeated_bom(tmp_path):
+    path = tmp_path / "a.txt"
+    assert write(path, "abc", mode="append", encoding="utf-16").startswith("✅")
+    assert write(path, "abc", mode="append", encoding="utf-16").startswith("❌")
+    assert write(path, "abc", mode="append", encoding="utf-16-le").startswith("✅")
+    assert read(path) == "abc".encode("utf-16") + "abc".encode("utf-16-le")
+
+def test_offset_rejects_bom(tmp_path):
+    path = tmp_path / "a.txt"
+    write(path, "abcdef")
+    assert write(path, "x", offset=2, encoding="utf-8-sig").startswith("❌")
+
+def test_upload_parts_and_commit(tmp_path):
+    path = tmp_path / "up.txt"
+    assert write(path, "ab", upload_id="u").startswith("✅")
+    # 重试首个分段
+    assert write(path, "ab", upload_id="u", part_offset=0).startswith("✅")
+    assert write(path, "cd", upload_id="u", part_offset=2).startswith("✅")
+    # 重试后续分段
+    assert write(path, "cd", upload_id="u", part_offset=2).startswith("✅")
+    assert not path.exists()
+    assert write(path, "ef", upload_id="u", part_offset=4, commit=True).startswith("✅")
+    assert read(path) == b"abcdef"
+    assert part_files(tmp_path) == []
+
+def test_upload_requires_part_offset_after_first_part(tmp_path):
+    path = tmp_path / "up.txt"
+    write(path, "ab", upload_id="u")
+    assert write(path, "cd", upload_id="u").startswith("❌")
+    assert write(path, "cd", upload_id="u", part_offset=9).startswith("❌")
+    assert write(path, "xx", upload_id="u", part_offset=0).startswith("❌")
+
+def test_upload_single_call(tmp_path):
+    path = tmp_path / "up.txt"
+    assert write(path, "xx", upload_id="u2", commit=True).startswith("✅")
+    assert read(path) == b"xx"
+    assert part_files(tmp_path) == []
+
+def test_commit_retry_reports_already_committed(tmp_path):
+    path = tmp_path / "up.txt"
+    write(path, "ab", upload_id="u")
+    write(path, "cd", upload_id="u", part_offset=2, commit=True)
+    assert "重复提交" in write(path, "cd", upload_id="u", part_offset=2, commit=True)
+    assert "重复提交" in write(path, "", upload_id="u", commit=True)
+    assert read(path) == b"abcd"
+
+def test_commit_unknown_upload_keeps_target(tmp_path):
+    path = tmp_path / "up.txt"
+    path.write_bytes(b"aab")
+    assert write(path, "", upload_id="nonexist", part_offset=5, commit=True).startswith("❌")
+    assert write(tmp_path / "missing.txt", "", upload_id="nonexist", commit=True).startswith("❌")
+    assert read(path) == b"aab"
+
+def test_upload_abort(tmp_path):
+    path = tmp_path / "up.txt"
+    write(path, "zz", upload_id="v")
+    assert part_files(tmp_path)
+    assert write(path, upload_id="v", abort=True).startswith("✅")
+    assert part_files(tmp_path) == []
+    assert not path.exists()
+    assert write(path, upload_id="v", abort=True).startswith("⚠️")
+
+def test_upload_rejects_bom_in_later_parts(tmp_path):
+    path = tmp_path / "up.txt"
+    assert write(path, "ab", upload_id="u", encoding="utf-16").startswith("✅")
+    assert write(path, "cd", upload_id="u", part_offset=4, encoding="utf-16").startswith("❌")
+
+def test_invalid_upload_id(tmp_path):
+    assert write(tmp_path / "x", upload_id="../x").startswith("❌")
+
+def test_stale_parts_cleaned_and_hidden(tmp_path):
+    path = tmp_path / "up.txt"
+    write(path, "ab", upload_id="old")
+    stale = tmp_path / ".up.txt.old.part"
+    expired = time.time() - ToolConfig.UPLOAD_PART_TTL - 10
+    os.utime(stale, (expired, expired))
+    listing = file_list(FileListParams(path=str(tmp_path)))
+    assert ".part" not in listing
+    write(path, "cd", upload_id="new")
+    assert part_files(tmp_path) == [".up.txt.new.part"]
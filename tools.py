@@ -5,14 +5,22 @@ MCP 工具模块
 """
 
 import os
+import re
 import json
+import uuid
+import time
+import locale
 import hashlib
+import functools
 import base64
 import subprocess
 import requests
+from io import BytesIO
 from datetime import datetime
 from typing import Optional, Dict, Any
 from pydantic import BaseModel
+from config import ToolConfig
+from tracing import tracer, trace_span
 
 # ==================== 参数模型 ====================
 
@@ -44,6 +52,13 @@ class FileWriteParams(BaseModel):
     path: str
     content: str
     encoding: Optional[str] = "utf-8"
+    mode: str = "overwrite"
+    offset: Optional[int] = None
+    upload_id: Optional[str] = None
+    part_offset: Optional[int] = None
+    commit: bool = False
+    abort: bool = False
+    fsync: Optional[str] = None
 
 class FileListParams(BaseModel):
     path: str = "."
@@ -53,8 +68,10 @@ class HashParams(BaseModel):
     algorithm: str = "md5"
 
 class Base64Params(BaseModel):
-    text: str
+    text: Optional[str] = None
     encode: bool = True
+    source_path: Optional[str] = None
+    dest_path: Optional[str] = None
 
 class SystemInfoParams(BaseModel):
     pass
@@ -68,6 +85,11 @@ class NetworkCheckParams(BaseModel):
 class JokeParams(BaseModel):
     category: Optional[str] = "any"
 
+class TracingParams(BaseModel):
+    enabled: Optional[bool] = None
+    profile_rate: Optional[float] = None
+    profile_tool: Optional[str] = None
+
 # ==================== 工具函数 ====================
 
 def hello(params: HelloParams) -> str:
@@ -114,18 +136,21 @@ def get_weather(params: WeatherParams) -> str:
     """获取天气信息"""
     try:
         url = f"http://wttr.in/{params.city}?format=j1"
-        response = requests.get(url, timeout=10)
+        with trace_span("upstream", url=url):
+            response = requests.get(url, timeout=10)
         
         if response.status_code == 200:
-            data = response.json()
+            with trace_span("parse"):
+                data = response.json()
             current = data.get('current_condition', [{}])[0]
             
-            weather_info = f"🌤️ {params.city} 天气信息:\n"
-            weather_info += f"温度: {current.get('temp_C', 'N/A')}°C\n"
-            weather_info += f"体感温度: {current.get('FeelsLikeC', 'N/A')}°C\n"
-            weather_info += f"湿度: {current.get('humidity', 'N/A')}%\n"
-            weather_info += f"天气: {current.get('lang_zh', [{}])[0].get('value', 'N/A')}\n"
-            weather_info += f"风速: {current.get('windspeedKmph', 'N/A')} km/h"
+            with trace_span("format"):
+                weather_info = f"🌤️ {params.city} 天气信息:\n"
+                weather_info += f"温度: {current.get('temp_C', 'N/A')}°C\n"
+                weather_info += f"体感温度: {current.get('FeelsLikeC', 'N/A')}°C\n"
+                weather_info += f"湿度: {current.get('humidity', 'N/A')}%\n"
+                weather_info += f"天气: {current.get('lang_zh', [{}])[0].get('value', 'N/A')}\n"
+                weather_info += f"风速: {current.get('windspeedKmph', 'N/A')} km/h"
             
             return weather_info
         else:
@@ -146,12 +171,15 @@ def translate(params: TranslateParams) -> str:
             'q': params.text
         }
         
-        response = requests.get(url, params=params_dict, timeout=10)
+        with trace_span("upstream", url=url):
+            response = requests.get(url, params=params_dict, timeout=10)
         
         if response.status_code == 200:
-            data = response.json()
-            translated_text = ''.join([sentence[0] for sentence in data[0] if sentence[0]])
-            return f"翻译结果:\n原文: {params.text}\n译文: {translated_text}"
+            with trace_span("parse"):
+                data = response.json()
+            with trace_span("format"):
+                translated_text = ''.join([sentence[0] for sentence in data[0] if sentence[0]])
+                return f"翻译结果:\n原文: {params.text}\n译文: {translated_text}"
         else:
             return f"翻译失败: {response.status_code}"
             
@@ -176,13 +204,155 @@ def file_read(params: FileReadParams) -> str:
     except Exception as e:
         return f"❌ 读取文件时发生错误: {str(e)}"
 
+FSYNC_POLICIES = ("never", "commit", "always")
+UPLOAD_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# 写入过程中使用的内部文件：分段文件 .{name}.{upload_id}.part 和临时文件 .{name}.{hex}.tmp
+INTERNAL_FILE_PATTERN = re.compile(r"^\..+\.[A-Za-z0-9_-]+\.(part|tmp)$")
+
+def _bom_length(encoding: str) -> int:
+    """编码在每次编码时附加的字节顺序标记 (BOM) 长度，如 utf-16、utf-8-sig"""
+    single = len("a".encode(encoding))
+    return 2 * single - len("aa".encode(encoding))
+
+def _cleanup_stale_parts(directory: str):
+    """删除超过 UPLOAD_PART_TTL 未更新的分段文件（已放弃的上传）"""
+    expire_before = time.time() - ToolConfig.UPLOAD_PART_TTL
+    for item in os.listdir(directory or "."):
+        if not item.endswith(".part") or not INTERNAL_FILE_PATTERN.match(item):
+            continue
+        item_path = os.path.join(directory, item)
+        try:
+            if os.path.getmtime(item_path) < expire_before:
+                os.remove(item_path)
+        except OSError:
+            pass
+
+def _fsync_file(f, policy: str, committing: bool):
+    """按 fsync 策略刷盘"""
+    if policy == "always" or (policy == "commit" and committing):
+        f.flush()
+        os.fsync(f.fileno())
+
+def _atomic_replace(tmp_path: str, path: str, policy: str = "never"):
+    """将临时文件原子替换为目标文件，并保留原文件权限；需要时对所在目录 fsync 以持久化重命名"""
+    if os.path.exists(path):
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+    os.replace(tmp_path, path)
+    if policy in ("commit", "always") and os.name != "nt":
+        dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def _write_part(part_path: str, data: bytes, part_offset: Optional[int], fsync: str, committing: bool) -> int:
+    """写入一个分段并返回分段文件的累计大小
+    
+    首个分段以独占方式创建分段文件；之后的分段需携带 part_offset（即写入前的累计大小），
+    重试已写入的分段会被识别并忽略，偏移不一致时报错
+    """
+    if not os.path.exists(part_path):
+        if part_offset not in (None, 0):
+            raise ValueError(f"分段文件不存在，part_offset 应为 0，实际为 {part_offset}")
+        with open(part_path, 'xb') as f:
+            f.write(data)
+            _fsync_file(f, fsync, committing)
+            return f.tell()
+    
+    with open(part_path, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        if not data:
+            _fsync_file(f, fsync, committing)
+            return size
+        if part_offset is None:
+            raise ValueError(f"分段文件已存在 ({size} bytes)，后续分段必须提供 part_offset")
+        if part_offset == size:
+            f.write(data)
+        elif part_offset + len(data) == size:
+            # 重试：内容一致则视为已写入
+            f.seek(part_offset)
+            if f.read(len(data)) != data:
+                raise ValueError(f"part_offset {part_offset} 处已有不同内容")
+        else:
+            raise ValueError(f"part_offset 不匹配: 期望 {size}，实际为 {part_offset}")
+        _fsync_file(f, fsync, committing)
+        return f.seek(0, os.SEEK_END)
+
 def file_write(params: FileWriteParams) -> str:
-    """写入本地文件"""
+    """写入本地文件，支持覆盖、追加、偏移写入和分段原子上传"""
     try:
-        os.makedirs(os.path.dirname(params.path), exist_ok=True)
+        fsync = (params.fsync or ToolConfig.FILE_FSYNC_POLICY).lower()
+        if fsync not in FSYNC_POLICIES:
+            return f"❌ 不支持的 fsync 策略: {fsync}"
+        mode = params.mode.lower()
+        if mode not in ("overwrite", "append"):
+            return f"❌ 不支持的写入模式: {params.mode}"
+        if params.offset is not None and (params.offset < 0 or mode == "append"):
+            return "❌ offset 必须为非负数，且不能与 append 模式同时使用"
+        
+        directory, name = os.path.split(params.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        encoding = params.encoding or locale.getpreferredencoding(False)
+        data = params.content.encode(encoding)
+        # 追加、偏移写入和后续分段会在文件中间重复写入 BOM
+        bom_error = f"❌ 编码 {encoding} 会写入 BOM，追加、偏移写入和后续分段请使用不带 BOM 的编码（如 utf-16-le）"
+        has_bom = _bom_length(encoding) > 0
+        
+        # 分段上传：各段追加到同目录的临时文件，commit 时原子重命名
+        if params.upload_id is not None:
+            if not UPLOAD_ID_PATTERN.match(params.upload_id):
+                return f"❌ 无效的 upload_id: {params.upload_id}"
+            if mode != "overwrite" or params.offset is not None:
+                return "❌ 分段上传不能与 append 模式或 offset 同时使用"
+            part_path = os.path.join(directory, f".{name}.{params.upload_id}.part")
+            if params.abort:
+                if not os.path.exists(part_path):
+                    return f"⚠️  分段上传不存在: {params.path} (upload_id={params.upload_id})"
+                os.remove(part_path)
+                return f"✅ 分段上传已取消: {params.path} (upload_id={params.upload_id})"
+            if not os.path.exists(part_path):
+                # 分段文件不存在且本次不是首个分段：可能是已成功提交后的重试
+                if params.commit and (params.part_offset or (params.part_offset is None and not data)):
+                    expected = (params.part_offset or 0) + len(data)
+                    if os.path.exists(params.path) and (
+                            params.part_offset is None or os.path.getsize(params.path) == expected):
+                        return f"✅ 分段上传已提交（重复提交）: {params.path} (upload_id={params.upload_id})"
+                    return f"❌ 分段上传不存在: {params.path} (upload_id={params.upload_id})"
+                _cleanup_stale_parts(directory)
+            elif data and has_bom:
+                return bom_error
+            try:
+                size = _write_part(part_path, data, params.part_offset, fsync, params.commit)
+            except FileExistsError:
+                return f"❌ 分段文件已存在，请提供 part_offset 或先取消上传: {params.path} (upload_id={params.upload_id})"
+            except ValueError as e:
+                return f"❌ {str(e)}"
+            if not params.commit:
+                return f"✅ 分段已写入: {params.path} (upload_id={params.upload_id}, 累计 {size} bytes)"
+            _atomic_replace(part_path, params.path, fsync)
+            return f"✅ 分段上传已提交: {params.path} ({size} bytes)"
+        
+        if mode == "append":
+            if has_bom and os.path.exists(params.path) and os.path.getsize(params.path) > 0:
+                return bom_error
+            with open(params.path, 'ab') as f:
+                f.write(data)
+                _fsync_file(f, fsync, False)
+            return f"✅ 已追加 {len(data)} bytes 到文件: {params.path}"
         
-        with open(params.path, 'w', encoding=params.encoding) as f:
+        if params.offset is not None:
+            if has_bom and params.offset > 0:
+                return bom_error
+            with open(params.path, 'r+b' if os.path.exists(params.path) else 'wb') as f:
+                f.seek(params.offset)
+                f.write(data)
+                _fsync_file(f, fsync, False)
+            return f"✅ 已在偏移 {params.offset} 处写入 {len(data)} bytes: {params.path}"
+        
+        with open(params.path, 'w', encoding=encoding) as f:
             f.write(params.content)
+            _fsync_file(f, fsync, False)
         
         return f"✅ 文件已写入: {params.path}"
         
@@ -202,6 +372,9 @@ def file_list(params: FileListParams) -> str:
         dirs = []
         
         for item in items:
+            # 跳过 fileWrite / base64Encode 写入过程中的分段和临时文件
+            if INTERNAL_FILE_PATTERN.match(item):
+                continue
             item_path = os.path.join(params.path, item)
             if os.path.isfile(item_path):
                 size = os.path.getsize(item_path)
@@ -245,16 +418,113 @@ def hash_text(params: HashParams) -> str:
     except Exception as e:
         return f"❌ 计算哈希时发生错误: {str(e)}"
 
+def _b64_encode_stream(src, dst, chunk_size: int) -> int:
+    """流式 Base64 编码，按 3 字节边界分块，返回写出的字节数"""
+    chunk_size = max(3, chunk_size - chunk_size % 3)
+    written = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        # 非最后一块的长度必须是 3 的倍数，否则中间会出现填充符
+        while len(chunk) % 3:
+            more = src.read(3 - len(chunk) % 3)
+            if not more:
+                break
+            chunk += more
+        encoded = base64.b64encode(chunk)
+        dst.write(encoded)
+        written += len(encoded)
+    return written
+
+BASE64_NON_ALPHABET = re.compile(rb"[^A-Za-z0-9+/=]")
+
+def _b64_decode_stream(src, dst, chunk_size: int, strict: bool = True) -> int:
+    """流式 Base64 解码，按 4 字符边界分块并忽略空白，返回写出的字节数
+    
+    strict 为 False 时与 base64.b64decode 默认行为一致，丢弃所有非 Base64 字符
+    """
+    pending = b""
+    written = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        if strict:
+            pending += b"".join(chunk.split())
+        else:
+            pending += BASE64_NON_ALPHABET.sub(b"", chunk)
+        aligned = len(pending) - len(pending) % 4
+        if aligned:
+            decoded = base64.b64decode(pending[:aligned], validate=True)
+            dst.write(decoded)
+            written += len(decoded)
+            pending = pending[aligned:]
+    if pending:
+        raise ValueError("Base64 数据长度不是 4 的倍数")
+    return written
+
 def base64_encode(params: Base64Params) -> str:
-    """Base64编码或解码"""
+    """Base64编码或解码，支持文件到文件的流式处理"""
     try:
+        if params.source_path is None and params.text is None:
+            return "❌ 需要提供 text 或 source_path"
+        if params.source_path is not None and not os.path.exists(params.source_path):
+            return f"❌ 文件不存在: {params.source_path}"
+        if (params.source_path is not None and params.dest_path is not None
+                and os.path.exists(params.dest_path)
+                and os.path.samefile(params.source_path, params.dest_path)):
+            return "❌ source_path 与 dest_path 不能是同一个文件"
+        if (params.source_path is not None and params.dest_path is None
+                and os.path.getsize(params.source_path) > ToolConfig.MAX_FILE_SIZE):
+            return (f"❌ 文件过大 (超过 {ToolConfig.MAX_FILE_SIZE} bytes)，"
+                    f"请使用 dest_path 将结果写入文件: {params.source_path}")
+        
         if params.encode:
-            encoded = base64.b64encode(params.text.encode('utf-8')).decode('utf-8')
-            return f"Base64 编码结果: {encoded}"
+            stream = _b64_encode_stream
+        elif params.source_path is not None:
+            stream = _b64_decode_stream
+        else:
+            # 内存文本沿用宽松解码，忽略非 Base64 字符
+            stream = functools.partial(_b64_decode_stream, strict=False)
+        action = "编码" if params.encode else "解码"
+        chunk_size = ToolConfig.BASE64_CHUNK_SIZE
+        
+        if params.source_path is not None:
+            src = open(params.source_path, 'rb')
         else:
-            decoded = base64.b64decode(params.text.encode('utf-8')).decode('utf-8')
-            return f"Base64 解码结果: {decoded}"
+            src = BytesIO(params.text.encode('utf-8'))
+        
+        with src:
+            if params.dest_path is not None:
+                # 先写入同目录临时文件，成功后再重命名，失败时不留下半成品
+                dest_dir, dest_name = os.path.split(params.dest_path)
+                if dest_dir:
+                    os.makedirs(dest_dir, exist_ok=True)
+                tmp_path = os.path.join(dest_dir, f".{dest_name}.{uuid.uuid4().hex}.tmp")
+                try:
+                    with open(tmp_path, 'xb') as dst:
+                        size = stream(src, dst, chunk_size)
+                        _fsync_file(dst, ToolConfig.FILE_FSYNC_POLICY, True)
+                    _atomic_replace(tmp_path, params.dest_path, ToolConfig.FILE_FSYNC_POLICY)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+                return f"✅ Base64 {action}完成: {params.dest_path} ({size} bytes)"
+            
+            dst = BytesIO()
+            stream(src, dst, chunk_size)
+        
+        if params.encode:
+            return f"Base64 编码结果: {dst.getvalue().decode('ascii')}"
+        try:
+            return f"Base64 解码结果: {dst.getvalue().decode('utf-8')}"
+        except UnicodeDecodeError:
+            return "❌ 解码结果不是有效的 UTF-8 文本，请使用 dest_path 写入文件"
             
+    except PermissionError:
+        return "❌ 没有权限访问文件"
     except Exception as e:
         return f"❌ Base64 操作时发生错误: {str(e)}"
 
@@ -338,7 +608,8 @@ def get_process_info(params: ProcessInfoParams) -> str:
 def check_network(params: NetworkCheckParams) -> str:
     """检查网络连接"""
     try:
-        response = requests.get(params.url, timeout=10)
+        with trace_span("upstream", url=params.url):
+            response = requests.get(params.url, timeout=10)
         
         if response.status_code == 200:
             return f"✅ 网络连接正常，可以访问 {params.url}"
@@ -359,40 +630,63 @@ def get_joke(params: JokeParams) -> str:
         if params.category != "any":
             url = f"https://v2.jokeapi.dev/joke/{params.category}"
         
-        response = requests.get(url, timeout=10)
+        with trace_span("upstream", url=url):
+            response = requests.get(url, timeout=10)
         
         if response.status_code == 200:
-            data = response.json()
+            with trace_span("parse"):
+                data = response.json()
             
-            if data.get('type') == 'single':
-                return f"😄 笑话:\n{data.get('joke', '没有找到笑话')}"
-            elif data.get('type') == 'twopart':
-                setup = data.get('setup', '')
-                delivery = data.get('delivery', '')
-                return f"😄 笑话:\n{setup}\n{delivery}"
-            else:
-                return "没有找到笑话"
+            with trace_span("format"):
+                if data.get('type') == 'single':
+                    return f"😄 笑话:\n{data.get('joke', '没有找到笑话')}"
+                elif data.get('type') == 'twopart':
+                    setup = data.get('setup', '')
+                    delivery = data.get('delivery', '')
+                    return f"😄 笑话:\n{setup}\n{delivery}"
+                else:
+                    return "没有找到笑话"
         else:
             return f"获取笑话失败: {response.status_code}"
             
     except Exception as e:
         return f"获取笑话时发生错误: {str(e)}"
 
+def configure_tracing(params: TracingParams) -> str:
+    """运行时调整追踪与采样分析"""
+    tracer.configure(
+        enabled=params.enabled,
+        profile_rate=params.profile_rate,
+        profile_tool=params.profile_tool
+    )
+    
+    result = "追踪设置:\n"
+    result += f"  追踪: {'开启' if tracer.enabled else '关闭'}\n"
+    result += f"  追踪文件: {tracer.trace_file}\n"
+    result += f"  采样比例: {tracer.profile_rate}\n"
+    result += f"  分析工具: {tracer.profile_tool or '无'}\n"
+    result += f"  分析输出目录: {tracer.profile_dir}"
+    return result
+
 # ==================== 工具注册函数 ====================
 
 def register_tools(mcp_server):
-    """注册所有工具到 MCP 服务器"""
-    mcp_server.tool("hello")(hello)
-    mcp_server.tool("getTime")(get_time)
-    mcp_server.tool("calculate")(calculate)
-    mcp_server.tool("getWeather")(get_weather)
-    mcp_server.tool("translate")(translate)
-    mcp_server.tool("fileRead")(file_read)
-    mcp_server.tool("fileWrite")(file_write)
-    mcp_server.tool("fileList")(file_list)
-    mcp_server.tool("hashText")(hash_text)
-    mcp_server.tool("base64Encode")(base64_encode)
-    mcp_server.tool("getSystemInfo")(get_system_info)
-    mcp_server.tool("getProcessInfo")(get_process_info)
-    mcp_server.tool("checkNetwork")(check_network)
-    mcp_server.tool("getJoke")(get_joke) 
\ No newline at end of file
+    """注册所有工具到 MCP 服务器（每个工具都经过追踪包装）"""
+    def register(name, fn):
+        mcp_server.tool(name)(tracer.wrap_tool(name, fn))
+    
+    register("hello", hello)
+    register("getTime", get_time)
+    register("calculate", calculate)
+    register("getWeather", get_weather)
+    register("translate", translate)
+    register("fileRead", file_read)
+    register("fileWrite", file_write)
+    register("fileList", file_list)
+    register("hashText", hash_text)
+    register("base64Encode", base64_encode)
+    register("getSystemInfo", get_system_info)
+    register("getProcessInfo", get_process_info)
+    register("configureTracing", configure_tracing)
+    register("checkNetwork", check_network)
+    register("getJoke", get_joke)
\ No newline at end of file
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+MCP 调用追踪模块
+按请求 ID 记录每次工具调用的阶段耗时（Chrome Trace Event 格式），
+并支持按比例或按工具名开启 cProfile 采样分析
+"""
+
+import os
+import json
+import time
+import uuid
+import atexit
+import random
+import logging
+import cProfile
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from fastmcp.server.middleware import Middleware
+from config import TracingConfig, clamp_rate
+
+logger = logging.getLogger(__name__)
+
+def _now_us() -> float:
+    """当前时间（微秒）"""
+    return time.perf_counter_ns() / 1000
+
+class _Trace:
+    """一次工具调用的追踪上下文，记录执行阶段的起止时间以便拆分校验和序列化耗时"""
+    __slots__ = ("request_id", "tool", "execute_start", "execute_end")
+
+    def __init__(self, tool: str):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.tool = tool
+        self.execute_start = None
+        self.execute_end = None
+
+# 当前调用的追踪上下文
+_current_trace: ContextVar[Optional[_Trace]] = ContextVar("mcp_trace", default=None)
+
+class Tracer:
+    """工具调用追踪器"""
+
+    def __init__(self, trace_file: str, profile_dir: str, enabled: bool = False,
+                 profile_rate: float = 0.0, profile_tool: Optional[str] = None,
+                 flush_interval: float = 1.0):
+        self.trace_file = trace_file
+        self.profile_dir = profile_dir
+        self.enabled = enabled
+        self.profile_rate = clamp_rate(profile_rate)
+        self.profile_tool = profile_tool
+        self.flush_interval = flush_interval
+        # 调用线程只把事件放入缓冲区，文件写入由后台线程完成
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._lines = []
+        self._jobs = []
+        self._wakeup = threading.Event()
+        self._writer = None
+        self._file = None
+
+    @classmethod
+    def from_config(cls) -> "Tracer":
+        """根据 TracingConfig 创建追踪器"""
+        return cls(
+            trace_file=TracingConfig.TRACE_FILE,
+            profile_dir=TracingConfig.PROFILE_DIR,
+            enabled=TracingConfig.ENABLED,
+            profile_rate=TracingConfig.PROFILE_RATE,
+            profile_tool=TracingConfig.PROFILE_TOOL,
+            flush_interval=TracingConfig.FLUSH_INTERVAL
+        )
+
+    def _open(self):
+        """打开追踪文件，新文件写入 JSON 数组开头（Trace Event 格式允许省略结尾的 ]）"""
+        directory = os.path.dirname(self.trace_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.trace_file, 'a', encoding='utf-8')
+        if self._file.tell() == 0:
+            self._file.write("[\n")
+
+    def emit(self, name: str, start_us: float, end_us: float, trace: _Trace, **args):
+        """写入一个完整事件 (ph = X)"""
+        event = {
+            "name": name,
+            "cat": trace.tool,
+            "ph": "X",
+            "ts": start_us,
+            "dur": end_us - start_us,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {"request_id": trace.request_id, "tool": trace.tool, **args}
+        }
+        self._submit(line=json.dumps(event, ensure_ascii=False) + ",\n")
+
+    def _submit(self, line: Optional[str] = None, job=None):
+        """将事件或写文件任务交给后台线程"""
+        with self._lock:
+            if line is not None:
+                self._lines.append(line)
+            if job is not None:
+                self._jobs.append(job)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, name="mcp-tracer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def _writer_loop(self):
+        """定期写入缓冲的事件"""
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """写入缓冲的事件并执行待写的分析结果，失败时只记录日志"""
+        with self._lock:
+            lines, self._lines = self._lines, []
+            jobs, self._jobs = self._jobs, []
+        with self._io_lock:
+            try:
+                if lines:
+                    if self._file is None:
+                        self._open()
+                    self._file.write("".join(lines))
+                    self._file.flush()
+            except Exception as e:
+                logger.warning("追踪事件写入失败，丢弃 %d 条: %s", len(lines), e)
+            for job in jobs:
+                try:
+                    job()
+                except Exception as e:
+                    logger.warning("分析结果写入失败: %s", e)
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """在当前调用中记录一个阶段；未开启追踪或不在调用中时不做任何事"""
+        trace = _current_trace.get()
+        if not self.enabled or trace is None:
+            yield
+            return
+        start = _now_us()
+        try:
+            yield
+        finally:
+            self.emit(name, start, _now_us(), trace, **args)
+
+    @contextmanager
+    def request(self, tool: str, split_phases: bool = False, **args):
+        """开始一次工具调用的追踪，已在调用中时复用当前请求 ID
+
+        split_phases 为 True 时（中间件层），执行阶段之前记为 validate（参数校验与分发），
+        之后记为 serialize（结果序列化）
+        """
+        if not self.enabled or _current_trace.get() is not None:
+            yield
+            return
+        trace = _Trace(tool)
+        token = _current_trace.set(trace)
+        start = _now_us()
+        try:
+            yield
+        finally:
+            end = _now_us()
+            if split_phases and trace.execute_start is not None:
+                self.emit("validate", start, trace.execute_start, trace)
+            if split_phases and trace.execute_end is not None:
+                self.emit("serialize", trace.execute_end, end, trace)
+            self.emit(f"tool:{tool}", start, end, trace, **args)
+            _current_trace.reset(token)
+
+    @contextmanager
+    def execute(self):
+        """记录工具函数本体的执行阶段"""
+        trace = _current_trace.get()
+        if not self.enabled or trace is None:
+            yield
+            return
+        trace.execute_start = _now_us()
+        try:
+            yield
+        finally:
+            trace.execute_end = _now_us()
+            self.emit("execute", trace.execute_start, trace.execute_end, trace)
+
+    def should_profile(self, tool: str) -> bool:
+        """判断本次调用是否需要采样分析"""
+        return tool == self.profile_tool or (
+            self.profile_rate > 0 and random.random() < self.profile_rate)
+
+    def _run_profiled(self, tool: str, fn, *args, **kwargs):
+        """在 cProfile 下执行函数并保存分析结果"""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 同一线程已有其他分析器在运行
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            trace = _current_trace.get()
+            request_id = trace.request_id if trace else uuid.uuid4().hex[:12]
+            path = os.path.join(self.profile_dir, f"{tool}-{request_id}.prof")
+            self._submit(job=functools.partial(self._dump_profile, profiler, path))
+
+    def _dump_profile(self, profiler: cProfile.Profile, path: str):
+        """在后台线程保存分析结果"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler.dump_stats(path)
+
+    def wrap_tool(self, tool: str, fn):
+        """包装工具函数，记录执行阶段并按需采样分析"""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not self.enabled and self.profile_tool is None and self.profile_rate <= 0:
+                return fn(*args, **kwargs)
+            with self.request(tool), self.execute():
+                if self.should_profile(tool):
+                    return self._run_profiled(tool, fn, *args, **kwargs)
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def configure(self, enabled: Optional[bool] = None, profile_rate: Optional[float] = None,
+                  profile_tool: Optional[str] = None):
+        """运行时调整追踪设置，profile_tool 传空字符串表示清除"""
+        if enabled is not None:
+            self.enabled = enabled
+        if profile_rate is not None:
+            self.profile_rate = clamp_rate(profile_rate)
+        if profile_tool is not None:
+            self.profile_tool = profile_tool or None
+
+class TracingMiddleware(Middleware):
+    """在 FastMCP 中间件层开始追踪，使校验和序列化阶段可以单独计时"""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+
+    async def on_call_tool(self, context, call_next):
+        with self.tracer.request(context.message.name, split_phases=True):
+            return await call_next(context)
+
+# 全局追踪器
+tracer = Tracer.from_config()
+
+def trace_span(name: str, **args):
+    """在工具函数中标记一个阶段，例如 upstream / parse / format"""
+    return tracer.span(name, **args)